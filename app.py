@@ -1,11 +1,17 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import os
+import json
+import time
+import threading
 from dotenv import load_dotenv
 
 from modules.retriever import get_retriever
 from modules.knowledge_builder import KnowledgeBuilder
-from modules.vector_db import get_vector_db
+from modules.vector_db import get_vector_db, validate_filters, METADATA_FIELDS
+from modules.snapshot import load_snapshot
+from modules.query_log import get_query_log
+from modules.query_promoter import QueryPromoter
 
 load_dotenv()
 
@@ -21,6 +27,31 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 retriever = get_retriever()
 kb_builder = KnowledgeBuilder()
 
+# 批量接口单次请求的查询数上限
+batch_max_queries = int(os.getenv("BATCH_MAX_QUERIES", 1000))
+
+# 新节点：知识库为空且配置了快照时直接从快照加载，否则从Doc库重建BM25
+_snapshot_path = os.getenv("KB_SNAPSHOT_PATH")
+_vector_db = get_vector_db()
+_kb_empty = not any(
+    c.count() for c in (
+        _vector_db.query_collection,
+        _vector_db.qa_collection,
+        _vector_db.doc_collection
+    )
+)
+if _snapshot_path and os.path.exists(_snapshot_path) and _kb_empty:
+    load_snapshot(_snapshot_path)
+else:
+    kb_builder.rebuild_bm25()
+
+# 后台用查询日志中的高频问题预热答案缓存
+query_log = get_query_log()
+if os.getenv("PREWARM_ENABLED", "true").lower() == "true":
+    threading.Thread(
+        target=QueryPromoter().prewarm, args=(retriever,), daemon=True
+    ).start()
+
 # ==================== 路由 ====================
 
 @app.route('/')
@@ -58,19 +89,26 @@ def upload_file():
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         file.save(filepath)
         
+        # 结构化元数据（产品线/文档日期/租户）
+        metadata = {
+            field: request.form.get(field, '').strip()
+            for field in METADATA_FIELDS
+        }
+        
         # 处理文件
         count = 0
         if filename.endswith('.pdf'):
-            count = kb_builder.process_pdf(filepath, kb_type)
+            count = kb_builder.process_pdf(filepath, kb_type, metadata)
         elif filename.endswith('.txt'):
-            count = kb_builder.process_txt(filepath, kb_type)
+            count = kb_builder.process_txt(filepath, kb_type, metadata)
         elif filename.endswith('.json'):
-            count = kb_builder.process_json(filepath)
+            count = kb_builder.process_json(filepath, metadata)
         else:
             return jsonify({'code': 400, 'msg': '不支持的文件格式'})
         
-        # 保存知识库
+        # 保存知识库，旧答案可能已过期
         kb_builder.persist()
+        retriever.clear_answer_cache()
         
         return jsonify({
             'code': 200,
@@ -91,8 +129,15 @@ def chat():
         if not query:
             return jsonify({'code': 400, 'msg': '查询内容不能为空'})
         
+        try:
+            filters = validate_filters(data.get('filters'))
+        except ValueError as e:
+            return jsonify({'code': 400, 'msg': str(e)})
+        
         # 执行检索
-        result = retriever.retrieve(query)
+        start = time.perf_counter()
+        result = retriever.retrieve(query, filters=filters)
+        query_log.log(query, result, (time.perf_counter() - start) * 1000, filters)
         
         return jsonify({
             'code': 200,
@@ -102,13 +147,77 @@ def chat():
                 'source': result['source'],
                 'layer': result['layer'],
                 'confidence': result['confidence'],
-                'contexts': result.get('contexts', [])
+                'contexts': result.get('contexts', []),
+                'cached': result.get('cached', False)
             }
         })
     
     except Exception as e:
         return jsonify({'code': 500, 'msg': f'错误: {str(e)}'})
 
+@app.route('/api/chat/batch', methods=['POST'])
+def chat_batch():
+    """批量聊天接口 - 以JSONL流式返回"""
+    try:
+        data = request.json or {}
+        queries = data.get('queries', [])
+        
+        try:
+            filters = validate_filters(data.get('filters'))
+        except ValueError as e:
+            return jsonify({'code': 400, 'msg': str(e)})
+        
+        try:
+            top_k = int(data.get('top_k', 5))
+        except (TypeError, ValueError):
+            return jsonify({'code': 400, 'msg': 'top_k必须为正整数'})
+        if top_k <= 0:
+            return jsonify({'code': 400, 'msg': 'top_k必须为正整数'})
+        
+        if not isinstance(queries, list):
+            return jsonify({'code': 400, 'msg': 'queries必须为列表'})
+        
+        if len(queries) > batch_max_queries:
+            return jsonify({'code': 400, 'msg': f'单次最多{batch_max_queries}条查询'})
+        
+        queries = [str(q).strip() for q in queries]
+        if not queries or not all(queries):
+            return jsonify({'code': 400, 'msg': '查询内容不能为空'})
+        
+        def generate():
+            # 响应头已发出，之后的异常只能以错误行的形式返回
+            index = 0
+            try:
+                for query, result in zip(
+                    queries, retriever.retrieve_batch(queries, top_k, filters)
+                ):
+                    if 'error' in result:
+                        line = {'index': index, 'query': query, 'error': result['error']}
+                    else:
+                        line = {
+                            'index': index,
+                            'query': query,
+                            'answer': result['result'],
+                            'source': result['source'],
+                            'layer': result['layer'],
+                            'confidence': result['confidence'],
+                            'contexts': result.get('contexts', [])
+                        }
+                    yield json.dumps(line, ensure_ascii=False) + '\n'
+                    index += 1
+            except Exception as e:
+                for i in range(index, len(queries)):
+                    line = {'index': i, 'query': queries[i], 'error': str(e)}
+                    yield json.dumps(line, ensure_ascii=False) + '\n'
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='application/x-ndjson'
+        )
+    
+    except Exception as e:
+        return jsonify({'code': 500, 'msg': f'错误: {str(e)}'})
+
 @app.route('/api/kb-stats', methods=['GET'])
 def kb_stats():
     """获取知识库统计"""
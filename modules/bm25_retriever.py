@@ -1,38 +1,190 @@
 from rank_bm25 import BM25Okapi
 import jieba
+import numpy as np
+from scipy import sparse
 from typing import List, Dict, Tuple
 import json
 import os
+import threading
 
-class BM25Retriever:
-    def __init__(self):
-        """初始化BM25检索器"""
+class BM25Index:
+    def __init__(self, docs: List[str] = None, doc_ids: List[str] = None,
+                 metadatas: List[Dict] = None,
+                 tokenized_docs: List[List[str]] = None):
+        """一份完整的BM25索引，建好后只读，检索时整体引用"""
+        self.documents = docs or []
+        self.doc_ids = doc_ids or [f"doc_{i}" for i in range(len(self.documents))]
+        self.metadatas = metadatas or [{} for _ in self.documents]
         self.bm25 = None
-        self.documents = []
-        self.doc_ids = []
-    
-    def add_documents(self, docs: List[str], doc_ids: List[str] = None):
-        """添加文档进行索引"""
-        self.documents = docs
-        self.doc_ids = doc_ids or [f"doc_{i}" for i in range(len(docs))]
+        # 批量打分用：词表及 文档x词 的BM25权重稀疏矩阵
+        self.vocab = {}
+        self.doc_weights = None
+        # 分区倒排表: {字段: {取值: 文档下标数组}}
+        self.partitions = {}
         
         # 分词
-        tokenized_docs = [list(jieba.cut(doc)) for doc in docs]
+        if tokenized_docs is None:
+            tokenized_docs = [list(jieba.cut(doc)) for doc in self.documents]
+        self.tokenized_docs = tokenized_docs
+        if not self.documents:
+            return
+        
         self.bm25 = BM25Okapi(tokenized_docs)
+        self._build_weights()
+        
+        # 按元数据建立分区
+        partitions = {}
+        for idx, metadata in enumerate(self.metadatas):
+            for field, value in (metadata or {}).items():
+                partitions.setdefault(field, {}).setdefault(value, []).append(idx)
+        self.partitions = {
+            field: {value: np.array(idxs) for value, idxs in values.items()}
+            for field, values in partitions.items()
+        }
+    
+    def _build_weights(self):
+        """预先计算 文档x词 的BM25权重（CSR），与BM25Okapi.get_scores公式一致"""
+        k1, b = self.bm25.k1, self.bm25.b
+        vocab = {}
+        rows, cols, tfs = [], [], []
+        for idx, freqs in enumerate(self.bm25.doc_freqs):
+            for term, tf in freqs.items():
+                rows.append(idx)
+                cols.append(vocab.setdefault(term, len(vocab)))
+                tfs.append(tf)
+        
+        rows = np.array(rows, dtype=np.int64)
+        tfs = np.array(tfs, dtype=float)
+        idf = np.zeros(len(vocab))
+        for term, col in vocab.items():
+            idf[col] = self.bm25.idf.get(term) or 0
+        
+        norm = k1 * (1 - b + b * np.array(self.bm25.doc_len) / self.bm25.avgdl)
+        weights = idf[cols] * tfs * (k1 + 1) / (tfs + norm[rows])
+        self.vocab = vocab
+        self.doc_weights = sparse.csr_matrix(
+            (weights, (rows, cols)),
+            shape=(len(self.bm25.doc_freqs), len(vocab))
+        )
+    
+    def candidates(self, filters: Dict = None):
+        """根据过滤条件取候选文档下标，None表示不过滤"""
+        if not filters:
+            return None
+        
+        candidates = None
+        for field, value in filters.items():
+            if value is None:
+                continue
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            postings = self.partitions.get(field, {})
+            idxs = np.unique(np.concatenate(
+                [postings.get(v, np.array([], dtype=int)) for v in values]
+                or [np.array([], dtype=int)]
+            )).astype(int)
+            candidates = idxs if candidates is None else np.intersect1d(candidates, idxs)
+        
+        return candidates
+    
+    def result(self, idx: int, score: float) -> Dict:
+        return {
+            'doc_id': self.doc_ids[idx],
+            'text': self.documents[idx],
+            'score': float(score),
+            'metadata': self.metadatas[idx]
+        }
+
+
+class BM25Retriever:
+    def __init__(self):
+        """初始化BM25检索器
+        
+        索引整体保存在一个BM25Index中：重建时先在局部构建新索引，再在锁内替换引用，
+        检索开始时取一次引用，因此并发检索始终看到完整一致的索引。
+        """
+        self._index = BM25Index()
+        # 串行化索引的重建/追加，避免并发追加互相覆盖
+        self._lock = threading.Lock()
+        # 批量打分时每次处理的查询数，限制中间结果的内存
+        self.batch_chunk_size = int(os.getenv("BM25_BATCH_CHUNK_SIZE", 256))
+    
+    @property
+    def bm25(self):
+        return self._index.bm25
+    
+    @property
+    def documents(self) -> List[str]:
+        return self._index.documents
+    
+    @property
+    def doc_ids(self) -> List[str]:
+        return self._index.doc_ids
+    
+    @property
+    def metadatas(self) -> List[Dict]:
+        return self._index.metadatas
+    
+    @property
+    def tokenized_docs(self) -> List[List[str]]:
+        return self._index.tokenized_docs
+    
+    def add_documents(self, docs: List[str], doc_ids: List[str] = None,
+                      metadatas: List[Dict] = None,
+                      tokenized_docs: List[List[str]] = None):
+        """添加文档进行索引（可传入已分词结果，如从快照加载时）"""
+        with self._lock:
+            self._index = BM25Index(docs, doc_ids, metadatas, tokenized_docs)
         
         print(f"✅ BM25已索引{len(docs)}个文档")
     
-    def search(self, query: str, top_k: int = 10) -> List[Tuple[str, float]]:
-        """BM25搜索"""
-        if self.bm25 is None:
+    def append_documents(self, docs: List[str], doc_ids: List[str],
+                         metadatas: List[Dict] = None):
+        """增量添加文档：只对新文档分词，与已有分词结果合并后重建统计
+        
+        已在索引中的doc_id会被跳过（如全量重建时已包含的文本段）。
+        """
+        metadatas = metadatas or [{} for _ in docs]
+        
+        with self._lock:
+            current = self._index
+            existing = set(current.doc_ids)
+            new = [
+                (doc, doc_id, metadata)
+                for doc, doc_id, metadata in zip(docs, doc_ids, metadatas)
+                if doc_id not in existing
+            ]
+            if not new:
+                return
+            
+            docs, doc_ids, metadatas = map(list, zip(*new))
+            self._index = BM25Index(
+                current.documents + docs,
+                current.doc_ids + doc_ids,
+                current.metadatas + metadatas,
+                current.tokenized_docs + [list(jieba.cut(doc)) for doc in docs]
+            )
+        
+        print(f"✅ BM25已追加{len(docs)}个文档，共{len(self._index.documents)}个")
+    
+    def search(self, query: str, top_k: int = 10,
+               filters: Dict = None) -> List[Tuple[str, float]]:
+        """BM25搜索（filters只在对应分区内打分）"""
+        index = self._index
+        if index.bm25 is None:
             return []
         
         query_tokens = list(jieba.cut(query))
-        scores = self.bm25.get_scores(query_tokens)
+        candidates = index.candidates(filters)
+        
+        if candidates is None:
+            candidates = np.arange(len(index.documents))
+            scores = index.bm25.get_scores(query_tokens)
+        else:
+            scores = index.bm25.get_batch_scores(query_tokens, candidates.tolist())
         
         # 排序
         ranked = sorted(
-            enumerate(scores),
+            zip(candidates, scores),
             key=lambda x: x[1],
             reverse=True
         )
@@ -40,14 +192,55 @@ class BM25Retriever:
         results = []
         for idx, score in ranked[:top_k]:
             if score > 0:
-                results.append({
-                    'doc_id': self.doc_ids[idx],
-                    'text': self.documents[idx],
-                    'score': float(score)
-                })
+                results.append(index.result(idx, score))
         
         return results
-
+    
+    def search_batch(self, queries: List[str], top_k: int = 10,
+                     filters: Dict = None) -> List[List[Dict]]:
+        """BM25批量搜索（稀疏矩阵打分，结果与逐条search一致）"""
+        index = self._index
+        if index.bm25 is None:
+            return [[] for _ in queries]
+        
+        candidates = index.candidates(filters)
+        if candidates is None:
+            doc_weights_t = index.doc_weights.T.tocsr()
+            candidates = np.arange(len(index.documents))
+        else:
+            doc_weights_t = index.doc_weights[candidates].T.tocsr()
+        
+        batch_results = []
+        for start in range(0, len(queries), self.batch_chunk_size):
+            chunk = queries[start:start + self.batch_chunk_size]
+            
+            # 查询词频矩阵 (n_queries x n_terms)，不在语料中的词不计分
+            rows, cols = [], []
+            for i, query in enumerate(chunk):
+                for token in jieba.cut(query):
+                    col = index.vocab.get(token)
+                    if col is not None:
+                        rows.append(i)
+                        cols.append(col)
+            query_tf = sparse.csr_matrix(
+                (np.ones(len(rows)), (rows, cols)),
+                shape=(len(chunk), len(index.vocab))
+            )
+            
+            scores = (query_tf @ doc_weights_t).tocsr()
+            scores.sort_indices()
+            
+            for i in range(len(chunk)):
+                row = scores.getrow(i)
+                # 稳定排序：同分时按文档顺序，与search中的sorted一致
+                order = np.argsort(-row.data, kind='stable')[:top_k]
+                batch_results.append([
+                    index.result(candidates[pos], score)
+                    for pos, score in zip(row.indices[order], row.data[order])
+                    if score > 0
+                ])
+        
+        return batch_results
 
 # 全局实例
 _bm25_retriever = BM25Retriever()
@@ -1,18 +1,23 @@
 import os
 import json
-from typing import List
+import threading
+from typing import List, Dict
 import PyPDF2
 import jieba
-from .vector_db import get_vector_db
+from .vector_db import get_vector_db, METADATA_FIELDS
 from .bm25_retriever import get_bm25_retriever
 
 class KnowledgeBuilder:
     def __init__(self):
         self.vector_db = get_vector_db()
         self.bm25 = get_bm25_retriever()
+        # 本次导入、尚未写入BM25的文本段: (doc_id, 文本, 元数据)
+        self._pending_bm25 = []
+        self._pending_lock = threading.Lock()
     
-    def process_pdf(self, file_path: str, kb_type: str = 'docs') -> int:
-        """处理PDF文件"""
+    def process_pdf(self, file_path: str, kb_type: str = 'docs',
+                    metadata: Dict = None) -> int:
+        """处理PDF文件（metadata: 产品线/文档日期/租户等）"""
         print(f"📄 处理PDF: {file_path}")
         
         count = 0
@@ -26,9 +31,10 @@ class KnowledgeBuilder:
                     # 分段处理
                     for segment in self._chunk_text(text):
                         if kb_type == 'docs':
-                            self.vector_db.add_doc_document(
+                            self._add_doc_segment(
                                 segment,
-                                source=os.path.basename(file_path)
+                                os.path.basename(file_path),
+                                metadata
                             )
                         
                         count += 1
@@ -39,8 +45,9 @@ class KnowledgeBuilder:
         print(f"✅ 已处理{count}个文本段")
         return count
     
-    def process_txt(self, file_path: str, kb_type: str = 'docs') -> int:
-        """处理TXT文件"""
+    def process_txt(self, file_path: str, kb_type: str = 'docs',
+                    metadata: Dict = None) -> int:
+        """处理TXT文件（metadata: 产品线/文档日期/租户等）"""
         print(f"📝 处理TXT: {file_path}")
         
         count = 0
@@ -50,9 +57,10 @@ class KnowledgeBuilder:
                 
                 for segment in self._chunk_text(text):
                     if kb_type == 'docs':
-                        self.vector_db.add_doc_document(
+                        self._add_doc_segment(
                             segment,
-                            source=os.path.basename(file_path)
+                            os.path.basename(file_path),
+                            metadata
                         )
                     
                     count += 1
@@ -63,8 +71,8 @@ class KnowledgeBuilder:
         print(f"✅ 已处理{count}个文本段")
         return count
     
-    def process_json(self, file_path: str) -> int:
-        """处理JSON格式的QA数据"""
+    def process_json(self, file_path: str, metadata: Dict = None) -> int:
+        """处理JSON格式的QA数据（条目内的元数据字段优先于metadata）"""
         print(f"📋 处理JSON: {file_path}")
         
         count = 0
@@ -79,17 +87,24 @@ class KnowledgeBuilder:
                     items = data.get('data', [])
                 
                 for item in items:
+                    item_metadata = {
+                        **(metadata or {}),
+                        **{k: item[k] for k in METADATA_FIELDS if k in item}
+                    }
+                    
                     if 'question' in item and 'answer' in item:
                         self.vector_db.add_qa_document(
                             item['question'],
-                            item['answer']
+                            item['answer'],
+                            metadata=item_metadata
                         )
                         count += 1
                     elif 'query' in item and 'answer' in item:
                         # 高质量query-answer对
                         self.vector_db.add_query_document(
                             item['query'],
-                            item['answer']
+                            item['answer'],
+                            metadata=item_metadata
                         )
                         count += 1
         
@@ -112,7 +127,48 @@ class KnowledgeBuilder:
         
         return chunks
     
+    def rebuild_bm25(self):
+        """用Doc库全部文本及元数据重建BM25分区索引"""
+        docs = self.vector_db.doc_collection.get(
+            include=['documents', 'metadatas']
+        )
+        
+        if docs['ids']:
+            self.bm25.add_documents(
+                docs['documents'],
+                docs['ids'],
+                [
+                    {k: m[k] for k in METADATA_FIELDS if k in m}
+                    for m in docs['metadatas']
+                ]
+            )
+    
+    def _add_doc_segment(self, segment: str, source: str, metadata: Dict = None):
+        """写入Doc库，并记下待增量加入BM25的文本段"""
+        doc_id = self.vector_db.add_doc_document(
+            segment,
+            source=source,
+            metadata=metadata
+        )
+        with self._pending_lock:
+            self._pending_bm25.append(
+                (doc_id, segment, self.vector_db._clean_metadata(metadata))
+            )
+    
     def persist(self):
         """保存知识库"""
         self.vector_db.persist()
+        
+        # 原子地取走待写入的文本段，并发上传各自追加，互不覆盖
+        with self._pending_lock:
+            pending, self._pending_bm25 = self._pending_bm25, []
+        
+        # BM25尚未建立时全量构建，否则只对新文本段分词后合并（已在索引中的段会被跳过）
+        if self.bm25.bm25 is None:
+            self.rebuild_bm25()
+        elif pending:
+            doc_ids, texts, metadatas = map(list, zip(*pending))
+            self.bm25.append_documents(texts, doc_ids, metadatas)
+        
+        self.vector_db.bump_kb_version()
         print("✅ 知识库已保存")
\ No newline at end of file
@@ -0,0 +1,80 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, List
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class QueryLog:
+    def __init__(self, log_path: str = None):
+        """初始化查询日志（JSONL，每行一条）"""
+        self.log_path = log_path or os.getenv("QUERY_LOG_PATH", "./data/query_log.jsonl")
+        os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        
+        # 聚类/预热只读取最近的这么多条，日志本身不截断
+        self.max_lines = int(os.getenv("QUERY_LOG_MAX_LINES", 100000))
+        self.read_block_size = 1 << 20
+    
+    def log(self, query: str, result: Dict, latency_ms: float, filters: Dict = None):
+        """记录一次问答：查询、过滤条件、命中层级、耗时和答案"""
+        record = {
+            'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'query': query,
+            'filters': filters or {},
+            'layer': result['layer'],
+            'type': result.get('type', ''),
+            'latency_ms': round(latency_ms, 2),
+            'answer': result['result'],
+            'source': result['source'],
+            'confidence': result['confidence'],
+            'cached': result.get('cached', False),
+            'kb_version': result.get('kb_version'),
+            'top_k': result.get('top_k'),
+        }
+        
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(line)
+    
+    def load(self, max_lines: int = None) -> List[Dict]:
+        """读取最近max_lines条日志（从文件末尾向前按块读取），跳过损坏的行"""
+        max_lines = self.max_lines if max_lines is None else max_lines
+        if max_lines <= 0 or not os.path.exists(self.log_path):
+            return []
+        
+        with open(self.log_path, 'rb') as f:
+            pos = f.seek(0, os.SEEK_END)
+            data = b''
+            while pos > 0 and data.count(b'\n') <= max_lines:
+                size = min(self.read_block_size, pos)
+                pos -= size
+                f.seek(pos)
+                data = f.read(size) + data
+        
+        lines = data.splitlines()
+        if pos > 0:
+            # 未读到文件开头时，第一行可能不完整
+            lines = lines[1:]
+        
+        records = []
+        for line in lines[-max_lines:]:
+            try:
+                records.append(json.loads(line))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                continue
+        
+        return records
+
+
+# 全局实例
+_query_log = None
+
+def get_query_log():
+    global _query_log
+    if _query_log is None:
+        _query_log = QueryLog()
+    return _query_log
\ No newline at end of file
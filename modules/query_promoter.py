@@ -0,0 +1,216 @@
+from typing import Dict, List
+import json
+import os
+import numpy as np
+from dotenv import load_dotenv
+from .query_log import get_query_log
+from .vector_db import get_vector_db
+from .retriever import RAGRetriever
+
+load_dotenv()
+
+class QueryPromoter:
+    def __init__(self, query_log=None, vector_db=None):
+        """基于查询日志的高频问题聚类、缓存预热与Query库提升"""
+        self.query_log = query_log or get_query_log()
+        self.vector_db = vector_db or get_vector_db()
+        
+        self.cluster_threshold = float(os.getenv("PROMOTE_CLUSTER_THRESHOLD", 0.90))
+        self.min_count = int(os.getenv("PROMOTE_MIN_COUNT", 3))
+        self.max_queries = int(os.getenv("PROMOTE_MAX_QUERIES", 5000))
+        self.prewarm_top_n = int(os.getenv("PREWARM_TOP_N", 100))
+        self.query_threshold = float(os.getenv("QUERY_THRESHOLD", 0.90))
+        
+        # 用于估算收益：单次LLM调用成本，以及日志中没有第1层记录时的延迟估计
+        self.llm_cost_per_call = float(os.getenv("LLM_COST_PER_CALL", 0.02))
+        self.layer1_latency_ms = float(os.getenv("PROMOTE_LAYER1_LATENCY_MS", 50))
+    
+    def cluster(self, records: List[Dict] = None) -> List[Dict]:
+        """按embedding把高频查询聚类（不同过滤条件分别聚类），按总频次降序返回"""
+        records = self.query_log.load() if records is None else records
+        
+        # 按 (过滤条件, 查询文本) 汇总
+        stats = {}
+        for r in records:
+            filters = r.get('filters') or {}
+            key = (self._filters_key(filters), r['query'].strip())
+            s = stats.setdefault(key, {
+                'filters': filters, 'count': 0, 'latest': None, 'slow_latencies': []
+            })
+            s['count'] += 1
+            s['latest'] = r
+            # 未走缓存且落在第2~5层的请求才真正调用了LLM
+            if r['layer'] > 1 and not r.get('cached'):
+                s['slow_latencies'].append(r['latency_ms'])
+        
+        keys = sorted(stats, key=lambda k: stats[k]['count'], reverse=True)
+        keys = keys[:self.max_queries]
+        if not keys:
+            return []
+        
+        # embedding已L2归一化，点积即余弦相似度
+        embeddings = self.vector_db.embedding_model.encode([query for _, query in keys])
+        
+        # 贪心聚类：按频次从高到低，并入同一过滤条件下最相近且超过阈值的簇，否则自成一簇
+        centers, clusters = {}, []
+        for i, key in enumerate(keys):
+            group = centers.setdefault(key[0], [])
+            if group:
+                sims = embeddings[[center for center, _ in group]] @ embeddings[i]
+                best = int(np.argmax(sims))
+                if sims[best] >= self.cluster_threshold:
+                    clusters[group[best][1]].append(key)
+                    continue
+            group.append((i, len(clusters)))
+            clusters.append([key])
+        
+        output = []
+        for members in clusters:
+            representative = stats[members[0]]['latest']
+            slow_latencies = [
+                latency for k in members for latency in stats[k]['slow_latencies']
+            ]
+            output.append({
+                'representative': members[0][1],
+                'members': [query for _, query in members],
+                'filters': stats[members[0]]['filters'],
+                'count': sum(stats[k]['count'] for k in members),
+                'answer': representative['answer'],
+                'layer': representative['layer'],
+                'slow_calls': len(slow_latencies),
+                'avg_latency_ms': float(np.mean(slow_latencies)) if slow_latencies else 0.0,
+                'latest': {query: stats[(fk, query)]['latest'] for fk, query in members},
+            })
+        
+        return sorted(output, key=lambda c: c['count'], reverse=True)
+    
+    @staticmethod
+    def _filters_key(filters: Dict) -> str:
+        return json.dumps(filters or {}, sort_keys=True, ensure_ascii=False)
+    
+    def _usable(self, record: Dict) -> bool:
+        """可复用的答案：生成于当前知识库版本，且与检索器答案缓存的判定一致（第2~4层且生成成功）"""
+        return (
+            record.get('kb_version') == self.vector_db.kb_version
+            and RAGRetriever.is_cacheable(record['layer'], record['answer'])
+        )
+    
+    @staticmethod
+    def _filter_metadata(filters: Dict):
+        """过滤条件 -> 提升后Query文档的元数据
+        
+        字段取多个值时无法对应单一元数据（写入任一取值都会把答案暴露给其他取值的检索），返回None。
+        """
+        metadata = {}
+        for field, value in (filters or {}).items():
+            if isinstance(value, list):
+                if len(value) != 1:
+                    return None
+                value = value[0]
+            metadata[field] = value
+        return metadata
+    
+    def prewarm(self, retriever) -> int:
+        """启动时用高频簇的历史答案预热检索器的答案缓存（按原过滤条件写入）"""
+        print("🔥 开始预热答案缓存...")
+        
+        count = 0
+        for cluster in self.cluster()[:self.prewarm_top_n]:
+            if cluster['count'] < self.min_count:
+                break
+            for query, record in cluster['latest'].items():
+                if not self._usable(record):
+                    continue
+                top_k = record.get('top_k', 5)
+                retriever.cache_answer(query, {
+                    'layer': record['layer'],
+                    'type': record.get('type', ''),
+                    'result': record['answer'],
+                    'source': record['source'],
+                    'confidence': record['confidence'],
+                    'contexts': [],
+                    'kb_version': record['kb_version'],
+                    'top_k': top_k
+                }, cluster['filters'] or None, top_k)
+                count += 1
+        
+        print(f"✅ 已预热{count}条答案")
+        return count
+    
+    def candidates(self, top_n: int = 20, clusters: List[Dict] = None) -> List[Dict]:
+        """可提升到Query库的高频簇
+        
+        已能在相同过滤条件下于第1层命中的、以及过滤字段取多个值的簇除外。
+        """
+        clusters = self.cluster() if clusters is None else clusters
+        pool = [
+            c for c in clusters
+            if c['count'] >= self.min_count
+            and self._usable(c['latest'][c['representative']])
+            and self._filter_metadata(c['filters']) is not None
+        ]
+        
+        if pool and self.vector_db.query_collection.count() > 0:
+            groups = {}
+            for c in pool:
+                groups.setdefault(self._filters_key(c['filters']), []).append(c)
+            
+            existing = set()
+            for group in groups.values():
+                hits = self.vector_db.search_query_batch(
+                    [c['representative'] for c in group], 1, self.query_threshold,
+                    filters=group[0]['filters'] or None
+                )
+                existing.update(id(c) for c, h in zip(group, hits) if h)
+            pool = [c for c in pool if id(c) not in existing]
+        
+        return pool[:top_n]
+    
+    def report(self, candidates: List[Dict], records: List[Dict] = None) -> Dict:
+        """估算提升后的延迟与LLM成本节省（以日志覆盖的时间段计）"""
+        records = self.query_log.load() if records is None else records
+        layer1 = [
+            r['latency_ms'] for r in records
+            if r['layer'] == 1 and not r.get('cached')
+        ]
+        layer1_latency = float(np.mean(layer1)) if layer1 else self.layer1_latency_ms
+        
+        rows = []
+        for c in candidates:
+            rows.append({
+                'query': c['representative'],
+                'filters': c['filters'],
+                'members': len(c['members']),
+                'count': c['count'],
+                'layer': c['layer'],
+                'slow_calls': c['slow_calls'],
+                'avg_latency_ms': round(c['avg_latency_ms'], 2),
+                'saved_latency_ms': round(
+                    c['slow_calls'] * max(c['avg_latency_ms'] - layer1_latency, 0), 2
+                ),
+                'saved_cost': round(c['slow_calls'] * self.llm_cost_per_call, 4),
+            })
+        
+        total = len(records)
+        covered = sum(c['count'] for c in candidates)
+        return {
+            'total_queries': total,
+            'layer1_latency_ms': round(layer1_latency, 2),
+            'covered_queries': covered,
+            'covered_ratio': covered / total if total else 0.0,
+            'saved_latency_ms': round(sum(r['saved_latency_ms'] for r in rows), 2),
+            'saved_cost': round(sum(r['saved_cost'] for r in rows), 4),
+            'candidates': rows,
+        }
+    
+    def promote(self, candidates: List[Dict]) -> List[str]:
+        """把候选簇的代表问题及答案批量写入Query库，过滤条件作为元数据写入"""
+        doc_ids = self.vector_db.add_query_documents(
+            [c['representative'] for c in candidates],
+            [c['answer'] for c in candidates],
+            [self._filter_metadata(c['filters']) for c in candidates]
+        )
+        self.vector_db.persist()
+        
+        print(f"✅ 已提升{len(doc_ids)}条到Query库")
+        return doc_ids
\ No newline at end of file
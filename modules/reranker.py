@@ -0,0 +1,98 @@
+from sentence_transformers import CrossEncoder
+import torch
+from collections import OrderedDict
+from typing import List, Dict, Tuple
+import threading
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class Reranker:
+    def __init__(self, model_name: str = None):
+        """初始化CPU交叉编码器"""
+        model_name = model_name or os.getenv(
+            "RERANK_MODEL",
+            "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+        )
+        
+        print(f"🔄 加载Rerank模型: {model_name}")
+        # 显式指定Sigmoid，使各层阈值统一作用在[0, 1]的得分上
+        self.model = CrossEncoder(
+            model_name, max_length=512, device="cpu",
+            default_activation_function=torch.nn.Sigmoid()
+        )
+        
+        # 单次前向的样本数，不小于候选池上限即可保证一次打分
+        self.batch_size = int(os.getenv("RERANK_BATCH_SIZE", 64))
+        
+        # (query, 文本) -> 得分 的LRU缓存
+        self.cache_size = int(os.getenv("RERANK_CACHE_SIZE", 10000))
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def score_pairs(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        """给(query, 文本)对打分，未缓存的部分一起送入模型"""
+        scores = [None] * len(pairs)
+        missing = []
+        
+        with self._lock:
+            for i, pair in enumerate(pairs):
+                if pair in self._cache:
+                    self._cache.move_to_end(pair)
+                    scores[i] = self._cache[pair]
+                else:
+                    missing.append(i)
+        
+        if missing:
+            unique_pairs = list(dict.fromkeys(pairs[i] for i in missing))
+            predicted = self.model.predict(
+                [list(pair) for pair in unique_pairs],
+                batch_size=self.batch_size,
+                show_progress_bar=False
+            )
+            new_scores = dict(zip(unique_pairs, (float(s) for s in predicted)))
+            
+            with self._lock:
+                self._cache.update(new_scores)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            
+            for i in missing:
+                scores[i] = new_scores[pairs[i]]
+        
+        return scores
+    
+    def rerank_batch(self, queries: List[str],
+                     results_list: List[List[Dict]]) -> List[List[Dict]]:
+        """批量重排，每条结果增加rerank_score并按其降序"""
+        pairs = [
+            (query, r['text'])
+            for query, results in zip(queries, results_list)
+            for r in results
+        ]
+        scores = iter(self.score_pairs(pairs))
+        
+        return [
+            sorted(
+                [{**r, 'rerank_score': next(scores)} for r in results],
+                key=lambda x: x['rerank_score'],
+                reverse=True
+            )
+            for results in results_list
+        ]
+    
+    def rerank(self, query: str, results: List[Dict]) -> List[Dict]:
+        """重排单个查询的候选"""
+        return self.rerank_batch([query], [results])[0]
+
+
+# 全局实例
+_reranker = None
+
+def get_reranker():
+    """单例模式获取Rerank模型，未启用时返回None"""
+    global _reranker
+    if _reranker is None and os.getenv("RERANK_ENABLED", "false").lower() == "true":
+        _reranker = Reranker()
+    return _reranker
\ No newline at end of file
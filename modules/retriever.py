@@ -1,7 +1,12 @@
-from typing import Dict, List, Tuple
+from typing import Dict, List, Tuple, Iterator
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
 from .vector_db import get_vector_db
 from .bm25_retriever import get_bm25_retriever
 from .llm_service import get_llm_service
+from .reranker import get_reranker
 import os
 from dotenv import load_dotenv
 
@@ -12,45 +17,300 @@ class RAGRetriever:
         self.vector_db = get_vector_db()
         self.bm25 = get_bm25_retriever()
         self.llm = get_llm_service()
+        self.reranker = get_reranker()
         
         # 阈值配置
         self.query_threshold = float(os.getenv("QUERY_THRESHOLD", 0.90))
         self.qa_threshold = float(os.getenv("QA_THRESHOLD", 0.75))
         self.doc_threshold = float(os.getenv("DOC_THRESHOLD", 0.70))
+        
+        # 重排配置：候选池上限、召回下限、送入LLM的条数及第2~4层命中阈值
+        # 第1层直接返回库中答案，始终按向量相似度QUERY_THRESHOLD判定，不参与重排
+        self.rerank_candidates = int(os.getenv("RERANK_CANDIDATES", 20))
+        self.rerank_recall_threshold = float(os.getenv("RERANK_RECALL_THRESHOLD", 0.50))
+        self.rerank_top_n = int(os.getenv("RERANK_TOP_N", 3))
+        self.rerank_thresholds = {
+            2: float(os.getenv("RERANK_QA_THRESHOLD", 0.60)),
+            3: float(os.getenv("RERANK_DOC_THRESHOLD", 0.50)),
+            4: float(os.getenv("RERANK_BM25_THRESHOLD", 0.30)),
+        }
+        
+        # 批量检索时LLM并发上限
+        self.batch_concurrency = int(os.getenv("BATCH_LLM_CONCURRENCY", 4))
+        # 批量检索每次检索的查询数，限制单次embedding/检索的规模
+        self.batch_chunk_size = int(os.getenv("BATCH_CHUNK_SIZE", 32))
+        
+        # 第2~4层答案缓存（LRU），只保存当前知识库版本生成的答案
+        self.answer_cache_size = int(os.getenv("ANSWER_CACHE_SIZE", 1000))
+        self._answer_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
     
-    def retrieve(self, query: str, top_k: int = 5) -> Dict:
-        """五层级联检索"""
+    def retrieve(self, query: str, top_k: int = 5,
+                 filters: Dict = None) -> Dict:
+        """五层级联检索（filters: 如 {"product_line": "fund"}，在索引内过滤）"""
         
         print(f"\n🔍 开始检索: {query}")
         
+        cached = self.get_cached_answer(query, filters, top_k)
+        if cached is not None:
+            print(f"⚡ 答案缓存命中 (第{cached['layer']}层)")
+            return cached
+        
+        # 检索开始时的知识库版本，期间若有上传，该答案不会进入缓存
+        kb_version = self.vector_db.kb_version
+        layer, results = self.select_layer(query, top_k, filters)
+        result = self._build_result(query, layer, results, top_k)
+        result['kb_version'] = kb_version
+        result['top_k'] = top_k
+        
+        if self.is_cacheable(result['layer'], result['result']):
+            self.cache_answer(query, result, filters, top_k)
+        
+        return result
+    
+    @staticmethod
+    def is_cacheable(layer: int, answer: str) -> bool:
+        """可缓存的答案：第2~4层有知识库依据且生成成功
+        
+        第1层本身即为直接命中无需缓存；第5层为无依据的自由生成，不缓存也不预热。
+        """
+        return 1 < layer < 5 and not answer.startswith('❌')
+    
+    @staticmethod
+    def _cache_key(query: str, filters: Dict = None, top_k: int = 5) -> Tuple[str, str, int]:
+        # top_k决定送入生成的上下文条数，不同top_k的答案不能互相复用
+        return (
+            query.strip(),
+            json.dumps(filters or {}, sort_keys=True, ensure_ascii=False),
+            top_k
+        )
+    
+    def get_cached_answer(self, query: str, filters: Dict = None, top_k: int = 5):
+        """查询答案缓存，未命中或答案生成于旧知识库版本时返回None"""
+        key = self._cache_key(query, filters, top_k)
+        with self._cache_lock:
+            if key not in self._answer_cache:
+                return None
+            if self._answer_cache[key].get('kb_version') != self.vector_db.kb_version:
+                del self._answer_cache[key]
+                return None
+            self._answer_cache.move_to_end(key)
+            return {**self._answer_cache[key], 'cached': True}
+    
+    def cache_answer(self, query: str, result: Dict, filters: Dict = None,
+                     top_k: int = 5):
+        """写入答案缓存（也用于启动时预热），result['kb_version']不是当前版本时忽略"""
+        key = self._cache_key(query, filters, top_k)
+        with self._cache_lock:
+            if result.get('kb_version') != self.vector_db.kb_version:
+                return
+            self._answer_cache[key] = result
+            self._answer_cache.move_to_end(key)
+            while len(self._answer_cache) > self.answer_cache_size:
+                self._answer_cache.popitem(last=False)
+    
+    def clear_answer_cache(self):
+        """清空答案缓存"""
+        with self._cache_lock:
+            self._answer_cache.clear()
+    
+    def select_layer(self, query: str, top_k: int = 5,
+                     filters: Dict = None) -> Tuple[int, List[Dict]]:
+        """逐层检索，返回命中的层级及送入生成的结果（不调用LLM）"""
+        
         # 第1层：Query库检索
         print("📍 【第1层】Query库检索...")
-        query_results = self.vector_db.search_query(
-            query, top_k, self.query_threshold
-        )
+        n_results, threshold = self._search_params(1, top_k)
+        query_results = self._accept(1, query, self.vector_db.search_query(
+            query, n_results, threshold, filters
+        ))
         
-        if query_results and query_results[0]['similarity'] > self.query_threshold:
-            print(f"✅ 【第1层】命中! 相似度: {query_results[0]['similarity']:.4f}")
-            return {
-                'layer': 1,
-                'type': 'query',
-                'result': query_results[0]['metadata'].get('answer', ''),
-                'source': 'Query库',
-                'confidence': query_results[0]['similarity']
-            }
+        if query_results:
+            print(f"✅ 【第1层】命中! 相似度: {self._confidence(1, query_results):.4f}")
+            return 1, query_results
         
         # 第2层：QA库检索
         print("📍 【第2层】QA库检索...")
-        qa_results = self.vector_db.search_qa(
-            query, top_k, self.qa_threshold
-        )
+        n_results, threshold = self._search_params(2, top_k)
+        qa_results = self._accept(2, query, self.vector_db.search_qa(
+            query, n_results, threshold, filters
+        ))
         
         if qa_results:
-            print(f"✅ 【第2层】命中! 相似度: {qa_results[0]['similarity']:.4f}")
+            print(f"✅ 【第2层】命中! 相似度: {self._confidence(2, qa_results):.4f}")
+            return 2, qa_results
+        
+        # 第3层：Doc库检索
+        print("📍 【第3层】Doc库检索...")
+        n_results, threshold = self._search_params(3, top_k)
+        doc_results = self._accept(3, query, self.vector_db.search_docs(
+            query, n_results, threshold, filters
+        ))
+        
+        if doc_results:
+            print(f"✅ 【第3层】命中! 相似度: {self._confidence(3, doc_results):.4f}")
+            return 3, doc_results
+        
+        # 第4层：BM25混合检索
+        print("📍 【第4层】BM25混合检索...")
+        n_results, _ = self._search_params(4, top_k)
+        bm25_results = self._accept(4, query, self.bm25.search(
+            query, n_results, filters
+        ))
+        
+        if bm25_results:
+            print(f"✅ 【第4层】命中! 得分: "
+                  f"{bm25_results[0].get('rerank_score', bm25_results[0]['score']):.4f}")
+            return 4, bm25_results
+        
+        # 第5层：自由生成
+        print("📍 【第5层】自由生成...")
+        return 5, []
+    
+    def retrieve_batch(self, queries: List[str], top_k: int = 5,
+                       filters: Dict = None) -> Iterator[Dict]:
+        """批量五层级联检索，按输入顺序逐条产出结果
+        
+        查询按batch_chunk_size分块处理：每块一次批量embedding、每个集合一次多查询检索，
+        BM25按矩阵打分，LLM调用按batch_concurrency并发；一块产出完毕后再检索下一块，
+        内存与首条结果的等待时间不随请求条数增长。
+        单条生成失败时该条产出 {'error': 错误信息}，不影响其余查询。
+        """
+        if not queries:
+            return
+        
+        print(f"\n🔍 开始批量检索: {len(queries)}条")
+        
+        # LLM生成：有界并发，按输入顺序产出
+        # 调用方提前停止迭代（如客户端断开）时取消尚未开始的LLM调用，且不再检索后续分块
+        executor = ThreadPoolExecutor(max_workers=self.batch_concurrency)
+        try:
+            for start in range(0, len(queries), self.batch_chunk_size):
+                chunk = queries[start:start + self.batch_chunk_size]
+                futures = [
+                    executor.submit(self._build_result, query, layer, results, top_k)
+                    for query, (layer, results) in zip(
+                        chunk, self.select_layer_batch(chunk, top_k, filters)
+                    )
+                ]
+                for future in futures:
+                    try:
+                        yield future.result()
+                    except Exception as e:
+                        yield {'error': str(e)}
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def select_layer_batch(self, queries: List[str], top_k: int = 5,
+                           filters: Dict = None) -> List[Tuple[int, List[Dict]]]:
+        """批量逐层检索，返回每条查询命中的层级及送入生成的结果（不调用LLM）"""
+        embeddings = self.vector_db.embedding_model.encode(queries)
+        hits = [None] * len(queries)
+        
+        # 第1~3层：每层只对尚未命中的查询做一次多查询检索
+        layers = [
+            (1, self.vector_db.search_query_batch),
+            (2, self.vector_db.search_qa_batch),
+            (3, self.vector_db.search_docs_batch),
+        ]
+        for layer, search_batch in layers:
+            pending = [i for i, hit in enumerate(hits) if hit is None]
+            if not pending:
+                break
             
+            pending_queries = [queries[i] for i in pending]
+            n_results, threshold = self._search_params(layer, top_k)
+            batch_results = self._accept_batch(layer, pending_queries, search_batch(
+                pending_queries, n_results, threshold,
+                query_embeddings=embeddings[pending],
+                filters=filters
+            ))
+            for i, results in zip(pending, batch_results):
+                if results:
+                    hits[i] = (layer, results)
+            
+            print(f"📍 【第{layer}层】批量命中 "
+                  f"{sum(1 for i in pending if hits[i] is not None)}/{len(pending)}")
+        
+        # 第4层：BM25矩阵打分
+        pending = [i for i, hit in enumerate(hits) if hit is None]
+        if pending:
+            pending_queries = [queries[i] for i in pending]
+            n_results, _ = self._search_params(4, top_k)
+            batch_results = self._accept_batch(4, pending_queries, self.bm25.search_batch(
+                pending_queries, n_results, filters
+            ))
+            for i, results in zip(pending, batch_results):
+                hits[i] = (4, results) if results else (5, [])
+        
+        return hits
+    
+    def _search_params(self, layer: int, top_k: int) -> Tuple[int, float]:
+        """各层召回条数与相似度阈值；启用重排时放宽第2~4层的召回，交给重排判定"""
+        if layer == 1:
+            return top_k, self.query_threshold
+        if self.reranker is None:
+            thresholds = {
+                1: self.query_threshold,
+                2: self.qa_threshold,
+                3: self.doc_threshold,
+            }
+            return top_k, thresholds.get(layer)
+        
+        return max(top_k, self.rerank_candidates), self.rerank_recall_threshold
+    
+    def _accept(self, layer: int, query: str, results: List[Dict]) -> List[Dict]:
+        """判断该层是否命中，返回送入生成的结果（未命中返回空列表）"""
+        return self._accept_batch(layer, [query], [results])[0]
+    
+    def _accept_batch(self, layer: int, queries: List[str],
+                      results_list: List[List[Dict]]) -> List[List[Dict]]:
+        """批量命中判定，启用重排时第2~4层的所有候选一次打分"""
+        if layer == 1:
+            return [
+                results if results and results[0]['similarity'] > self.query_threshold else []
+                for results in results_list
+            ]
+        if self.reranker is None:
+            return results_list
+        
+        ranked_list = self.reranker.rerank_batch(
+            queries,
+            [results[:self.rerank_candidates] for results in results_list]
+        )
+        return [
+            [
+                r for r in ranked
+                if r['rerank_score'] >= self.rerank_thresholds[layer]
+            ][:self.rerank_top_n]
+            for ranked in ranked_list
+        ]
+    
+    @staticmethod
+    def _confidence(layer: int, results: List[Dict]) -> float:
+        """命中置信度：有重排得分时使用重排得分（Sigmoid后落在[0, 1]）"""
+        if 'rerank_score' in results[0]:
+            return results[0]['rerank_score']
+        if layer == 4:
+            return min(results[0]['score'] / 100, 0.9)
+        return results[0]['similarity']
+    
+    def _build_result(self, query: str, layer: int, results: List[Dict],
+                      top_k: int) -> Dict:
+        """根据命中层级组装返回结果（第2~5层调用LLM）"""
+        if layer == 1:
+            return {
+                'layer': 1,
+                'type': 'query',
+                'result': results[0]['metadata'].get('answer', ''),
+                'source': 'Query库',
+                'confidence': self._confidence(1, results)
+            }
+        
+        if layer == 2:
             qa_contexts = [
                 f"Q: {r['metadata'].get('question', '')}\nA: {r['metadata'].get('answer', '')}"
-                for r in qa_results[:top_k]
+                for r in results[:top_k]
             ]
             
             answer = self.llm.generate_with_context(query, qa_contexts)
@@ -60,20 +320,12 @@ class RAGRetriever:
                 'type': 'qa',
                 'result': answer,
                 'source': 'QA库 + LLM',
-                'confidence': qa_results[0]['similarity'],
+                'confidence': self._confidence(2, results),
                 'contexts': qa_contexts
             }
         
-        # 第3层：Doc库检索
-        print("📍 【第3层】Doc库检索...")
-        doc_results = self.vector_db.search_docs(
-            query, top_k, self.doc_threshold
-        )
-        
-        if doc_results:
-            print(f"✅ 【第3层】命中! 相似度: {doc_results[0]['similarity']:.4f}")
-            
-            doc_contexts = [r['text'] for r in doc_results[:top_k]]
+        if layer == 3:
+            doc_contexts = [r['text'] for r in results[:top_k]]
             answer = self.llm.generate_with_context(query, doc_contexts)
             
             return {
@@ -81,18 +333,12 @@ class RAGRetriever:
                 'type': 'docs',
                 'result': answer,
                 'source': 'Doc库 + LLM',
-                'confidence': doc_results[0]['similarity'],
+                'confidence': self._confidence(3, results),
                 'contexts': doc_contexts
             }
         
-        # 第4层：BM25混合检索
-        print("📍 【第4层】BM25混合检索...")
-        bm25_results = self.bm25.search(query, top_k)
-        
-        if bm25_results:
-            print(f"✅ 【第4层】命中! 得分: {bm25_results[0]['score']:.4f}")
-            
-            bm25_contexts = [r['text'] for r in bm25_results[:top_k]]
+        if layer == 4:
+            bm25_contexts = [r['text'] for r in results[:top_k]]
             answer = self.llm.generate_with_context(query, bm25_contexts)
             
             return {
@@ -100,17 +346,14 @@ class RAGRetriever:
                 'type': 'bm25',
                 'result': answer,
                 'source': 'BM25 + LLM',
-                'confidence': min(bm25_results[0]['score'] / 100, 0.9),
+                'confidence': self._confidence(4, results),
                 'contexts': bm25_contexts
             }
         
-        # 第5层：自由生成
-        print("📍 【第5层】自由生成...")
-        
         free_prompt = f"""用户问题: {query}
 
 请基于你的知识进行回答。如果你不确定答案，请告诉用户。"""
-        
+
         answer = self.llm.generate(free_prompt)
         
         return {
@@ -121,7 +364,6 @@ class RAGRetriever:
             'confidence': 0.5
         }
 
-
 # 全局实例
 _retriever = None
 
@@ -0,0 +1,312 @@
+import hashlib
+import json
+import os
+import struct
+import time
+from typing import Dict, List, Tuple
+
+import jieba
+import numpy as np
+
+from .vector_db import get_vector_db, METADATA_FIELDS
+from .bm25_retriever import get_bm25_retriever
+
+# 文件布局:
+#   MAGIC(8) | 版本 uint32 | 头长度 uint64 | 头sha256(32) | 头JSON | 对齐填充 | 数据块...
+# 头JSON只含计数和数据块索引(偏移/类型/形状/sha256)，所有数据都在按ALIGN对齐的
+# 二进制块中，可直接np.memmap映射：
+#   {集合}.embeddings              float32/float16 (n, dim)
+#   {集合}.{ids|documents|metadatas}.offsets/.data   字符串表（uint64偏移 + UTF-8字节）
+#   bm25.vocab.offsets/.data       BM25词表
+#   bm25.tokens / bm25.token_offsets  doc_kb每行的词ID序列（int32）与偏移，文本/元数据引用doc_kb
+MAGIC = b"FRAGSNAP"
+SNAPSHOT_VERSION = 2
+ALIGN = 64
+PREAMBLE = struct.Struct("<8sIQ32s")
+
+# 快照中的集合名 -> VectorDB上的属性名
+COLLECTIONS = {
+    "query_kb": "query_collection",
+    "qa_kb": "qa_collection",
+    "doc_kb": "doc_collection",
+}
+
+# Chroma单次add的条数上限
+IMPORT_BATCH_SIZE = 5000
+
+
+def _align(n: int) -> int:
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _string_table(strings: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """字符串列表 -> (uint64偏移, UTF-8字节)"""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded], dtype=np.uint64)
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def _read_strings(blocks: Dict, name: str) -> List[str]:
+    """从字符串表块解码字符串列表"""
+    offsets = blocks[f"{name}.offsets"]
+    data = blocks[f"{name}.data"].tobytes()
+    return [
+        data[offsets[i]:offsets[i + 1]].decode("utf-8")
+        for i in range(len(offsets) - 1)
+    ]
+
+
+def export_snapshot(path: str, dtype: str = "float32",
+                    vector_db=None, bm25=None) -> Dict[str, int]:
+    """导出整个知识库（三个集合 + BM25分词结果）为单个快照文件"""
+    if dtype not in ("float32", "float16"):
+        raise ValueError(f"不支持的embedding精度: {dtype}")
+    
+    vector_db = vector_db or get_vector_db()
+    bm25 = bm25 or get_bm25_retriever()
+    
+    print(f"📦 导出快照: {path} ({dtype})")
+    
+    arrays = {}
+    header = {
+        "version": SNAPSHOT_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "embedding_model": os.getenv("EMBEDDING_MODEL", ""),
+        "dtype": dtype,
+        "embedding_dim": None,
+        "collections": {},
+        "bm25": False,
+        "blocks": {},
+    }
+    
+    doc_data = None
+    for name, attr in COLLECTIONS.items():
+        data = getattr(vector_db, attr).get(
+            include=["documents", "metadatas", "embeddings"]
+        )
+        embeddings = np.asarray(
+            data["embeddings"] if data["embeddings"] is not None else [],
+            dtype=dtype
+        )
+        if embeddings.size == 0:
+            embeddings = embeddings.reshape(0, 0)
+        
+        if len(embeddings):
+            header["embedding_dim"] = int(embeddings.shape[1])
+        
+        arrays[f"{name}.embeddings"] = embeddings
+        for field, strings in (
+            ("ids", data["ids"]),
+            ("documents", data["documents"]),
+            ("metadatas", [json.dumps(m or {}, ensure_ascii=False) for m in data["metadatas"]]),
+        ):
+            offsets, raw = _string_table(strings)
+            arrays[f"{name}.{field}.offsets"] = offsets
+            arrays[f"{name}.{field}.data"] = raw
+        
+        header["collections"][name] = {"count": len(data["ids"])}
+        if name == "doc_kb":
+            doc_data = data
+    
+    # BM25只保存doc_kb每行的分词结果，内存中没有的行在导出时补分词
+    if doc_data["ids"]:
+        tokenized = dict(zip(bm25.doc_ids, bm25.tokenized_docs))
+        vocab = {}
+        token_ids, token_offsets = [], [0]
+        for doc_id, text in zip(doc_data["ids"], doc_data["documents"]):
+            tokens = tokenized.get(doc_id)
+            if tokens is None:
+                tokens = list(jieba.cut(text))
+            token_ids.extend(vocab.setdefault(t, len(vocab)) for t in tokens)
+            token_offsets.append(len(token_ids))
+        
+        vocab_offsets, vocab_raw = _string_table(list(vocab))
+        arrays["bm25.vocab.offsets"] = vocab_offsets
+        arrays["bm25.vocab.data"] = vocab_raw
+        arrays["bm25.tokens"] = np.asarray(token_ids, dtype=np.int32)
+        arrays["bm25.token_offsets"] = np.asarray(token_offsets, dtype=np.uint64)
+        header["bm25"] = True
+    
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        header["blocks"][name] = {
+            "offset": offset,
+            "dtype": array.dtype.name,
+            "shape": list(array.shape),
+            "sha256": hashlib.sha256(array.tobytes()).hexdigest(),
+        }
+        offset = _align(offset + array.nbytes)
+    
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    data_start = _align(PREAMBLE.size + len(header_bytes))
+    
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(PREAMBLE.pack(
+            MAGIC, SNAPSHOT_VERSION, len(header_bytes),
+            hashlib.sha256(header_bytes).digest()
+        ))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + header["blocks"][name]["offset"])
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+    
+    counts = {name: c["count"] for name, c in header["collections"].items()}
+    print(f"✅ 快照已导出: {counts}")
+    return counts
+
+
+def read_snapshot(path: str, verify: bool = True) -> Tuple[Dict, Dict]:
+    """读取快照，返回 (头信息, {块名: 只读内存映射数组})
+    
+    verify=True时校验文件头和每个数据块的sha256；文件损坏、截断或版本不符时抛出ValueError。
+    """
+    file_size = os.path.getsize(path)
+    if file_size < PREAMBLE.size:
+        raise ValueError(f"快照文件不完整: {path}")
+    
+    with open(path, "rb") as f:
+        magic, version, header_len, header_digest = PREAMBLE.unpack(
+            f.read(PREAMBLE.size)
+        )
+        if magic != MAGIC:
+            raise ValueError(f"不是知识库快照文件: {path}")
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"不支持的快照版本{version}，当前版本为{SNAPSHOT_VERSION}")
+        
+        header_bytes = f.read(header_len)
+    
+    if len(header_bytes) != header_len:
+        raise ValueError("快照文件不完整")
+    if verify and hashlib.sha256(header_bytes).digest() != header_digest:
+        raise ValueError("快照文件头校验失败")
+    
+    header = json.loads(header_bytes.decode("utf-8"))
+    data_start = _align(PREAMBLE.size + header_len)
+    
+    blocks = {}
+    for name, meta in header["blocks"].items():
+        shape = tuple(meta["shape"])
+        offset = data_start + meta["offset"]
+        nbytes = int(np.prod(shape)) * np.dtype(meta["dtype"]).itemsize
+        
+        if offset + nbytes > file_size:
+            raise ValueError(f"快照数据块{name}不完整")
+        
+        if nbytes == 0:
+            array = np.zeros(shape, dtype=meta["dtype"])
+        else:
+            array = np.memmap(
+                path, dtype=meta["dtype"], mode="r",
+                offset=offset, shape=shape
+            )
+        
+        if verify and hashlib.sha256(array).hexdigest() != meta["sha256"]:
+            raise ValueError(f"快照数据块{name}校验失败")
+        
+        blocks[name] = array
+    
+    return header, blocks
+
+
+def _check_compatible(header: Dict, blocks: Dict, vector_db, force: bool):
+    """快照的embedding模型/维度须与当前配置一致，否则抛出ValueError（force=True时只警告）"""
+    problems = []
+    
+    model_name = os.getenv("EMBEDDING_MODEL", "")
+    if header["embedding_model"] and model_name and header["embedding_model"] != model_name:
+        problems.append(
+            f"快照embedding模型({header['embedding_model']})与当前配置({model_name})不一致"
+        )
+    
+    dims = {
+        blocks[f"{name}.embeddings"].shape[1]
+        for name, c in header["collections"].items() if c["count"]
+    }
+    if len(dims) > 1 or (dims and header.get("embedding_dim") not in (None, *dims)):
+        problems.append(f"快照中的embedding维度不一致: {sorted(dims)}")
+    
+    model_dim = getattr(vector_db.embedding_model, "embedding_dim", None)
+    if dims and model_dim and dims != {model_dim}:
+        problems.append(f"快照embedding维度{sorted(dims)}与当前模型维度{model_dim}不一致")
+    
+    if not problems:
+        return
+    if not force:
+        raise ValueError("；".join(problems) + "，如确认兼容请使用force=True")
+    for problem in problems:
+        print(f"⚠️ {problem}")
+
+
+def load_snapshot(path: str, replace: bool = False, verify: bool = True,
+                  force: bool = False, vector_db=None, bm25=None) -> Dict[str, int]:
+    """从快照恢复知识库，不重新计算embedding、不重新分词
+    
+    向量仍需逐批写入Chroma并由其重建HNSW索引，耗时随条数线性增长。
+    所有校验（完整性、embedding模型与维度、目标集合是否为空）都在改动知识库之前完成；
+    replace=False时目标集合必须为空，replace=True会在校验通过后清空三个集合。
+    """
+    vector_db = vector_db or get_vector_db()
+    bm25 = bm25 or get_bm25_retriever()
+    
+    print(f"📦 加载快照: {path}")
+    start_time = time.perf_counter()
+    header, blocks = read_snapshot(path, verify)
+    
+    _check_compatible(header, blocks, vector_db, force)
+    
+    if not replace:
+        for name, attr in COLLECTIONS.items():
+            if getattr(vector_db, attr).count() > 0:
+                raise ValueError(f"集合{name}非空，如需覆盖请使用replace=True")
+    else:
+        for name in COLLECTIONS:
+            vector_db.client.delete_collection(name)
+        vector_db._init_collections()
+    
+    counts = {}
+    doc_rows = None
+    for name, attr in COLLECTIONS.items():
+        ids = _read_strings(blocks, f"{name}.ids")
+        documents = _read_strings(blocks, f"{name}.documents")
+        metadatas = [json.loads(m) for m in _read_strings(blocks, f"{name}.metadatas")]
+        embeddings = blocks[f"{name}.embeddings"]
+        
+        target = getattr(vector_db, attr)
+        total = len(ids)
+        for start in range(0, total, IMPORT_BATCH_SIZE):
+            end = min(start + IMPORT_BATCH_SIZE, total)
+            target.add(
+                ids=ids[start:end],
+                documents=documents[start:end],
+                metadatas=metadatas[start:end],
+                embeddings=np.asarray(
+                    embeddings[start:end], dtype=np.float32
+                ).tolist()
+            )
+        counts[name] = total
+        if name == "doc_kb":
+            doc_rows = (ids, documents, metadatas)
+    
+    counts["bm25"] = 0
+    if header["bm25"]:
+        ids, documents, metadatas = doc_rows
+        vocab = np.array(_read_strings(blocks, "bm25.vocab"), dtype=object)
+        tokens = blocks["bm25.tokens"]
+        offsets = blocks["bm25.token_offsets"]
+        bm25.add_documents(
+            documents,
+            ids,
+            [{k: m[k] for k in METADATA_FIELDS if k in m} for m in metadatas],
+            [vocab[tokens[offsets[i]:offsets[i + 1]]].tolist() for i in range(len(ids))]
+        )
+        counts["bm25"] = len(ids)
+    
+    vector_db.bump_kb_version()
+    
+    print(f"✅ 快照已加载: {counts}，耗时{time.perf_counter() - start_time:.1f}s")
+    return counts
@@ -1,6 +1,7 @@
 import chromadb
 from chromadb.config import Settings
 import os
+import threading
 from dotenv import load_dotenv
 from typing import List, Dict, Tuple
 import numpy as np
@@ -8,6 +9,31 @@ from .embedding_model import get_embedding_model
 
 load_dotenv()
 
+# 支持按其过滤/分区的结构化元数据字段
+METADATA_FIELDS = ("product_line", "doc_date", "tenant")
+
+def validate_filters(filters) -> Dict:
+    """校验检索过滤条件，不合法时抛出ValueError；无条件时返回None
+    
+    只接受METADATA_FIELDS中的字段，取值为标量或非空标量列表。
+    """
+    if filters is None:
+        return None
+    if not isinstance(filters, dict):
+        raise ValueError("filters必须为对象")
+    
+    scalar = (str, int, float, bool)
+    for field, value in filters.items():
+        if field not in METADATA_FIELDS:
+            raise ValueError(f"不支持的过滤字段: {field}")
+        if isinstance(value, list):
+            if not value or not all(isinstance(v, scalar) for v in value):
+                raise ValueError(f"过滤字段{field}的取值必须为非空标量列表")
+        elif not isinstance(value, scalar):
+            raise ValueError(f"过滤字段{field}的取值必须为标量或列表")
+    
+    return filters or None
+
 class VectorDB:
     def __init__(self, persist_dir: str = None):
         """初始化向量数据库"""
@@ -23,9 +49,30 @@ class VectorDB:
         self.client = chromadb.Client(settings)
         self.embedding_model = get_embedding_model()
         
+        # 知识库版本号：每次写入/导入后递增并保存在库目录中，
+        # 用于判断缓存和查询日志中的答案是否生成于当前版本
+        self._version_path = os.path.join(persist_dir, "kb_version")
+        self._version_lock = threading.Lock()
+        self.kb_version = self._load_kb_version()
+        
         # 初始化三个集合
         self._init_collections()
     
+    def _load_kb_version(self) -> int:
+        try:
+            with open(self._version_path, 'r') as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+    
+    def bump_kb_version(self) -> int:
+        """知识库内容变化后递增版本号，之前生成的答案视为过期"""
+        with self._version_lock:
+            self.kb_version += 1
+            with open(self._version_path, 'w') as f:
+                f.write(str(self.kb_version))
+            return self.kb_version
+    
     def _init_collections(self):
         """初始化三个知识库集合"""
         self.query_collection = self.client.get_or_create_collection(
@@ -43,7 +90,8 @@ class VectorDB:
         
         print("✅ 三个知识库集合初始化完成")
     
-    def add_query_document(self, query: str, answer: str, doc_id: str = None):
+    def add_query_document(self, query: str, answer: str, doc_id: str = None,
+                          metadata: Dict = None):
         """添加Query类型文档"""
         if doc_id is None:
             doc_id = f"query_{self.query_collection.count() + 1}"
@@ -53,11 +101,36 @@ class VectorDB:
         self.query_collection.add(
             documents=[query],
             embeddings=[embedding.tolist()],
-            metadatas=[{"type": "query", "answer": answer}],
+            metadatas=[{"type": "query", "answer": answer,
+                        **self._clean_metadata(metadata)}],
             ids=[doc_id]
         )
     
-    def add_qa_document(self, question: str, answer: str, doc_id: str = None):
+    def add_query_documents(self, queries: List[str], answers: List[str],
+                           metadatas: List[Dict] = None) -> List[str]:
+        """批量添加Query类型文档（一次embedding、一次写入）"""
+        if not queries:
+            return []
+        
+        start = self.query_collection.count()
+        doc_ids = [f"query_{start + i + 1}" for i in range(len(queries))]
+        embeddings = self.embedding_model.encode(queries)
+        metadatas = metadatas or [None] * len(queries)
+        
+        self.query_collection.add(
+            documents=queries,
+            embeddings=[e.tolist() for e in embeddings],
+            metadatas=[
+                {"type": "query", "answer": answer, **self._clean_metadata(metadata)}
+                for answer, metadata in zip(answers, metadatas)
+            ],
+            ids=doc_ids
+        )
+        
+        return doc_ids
+    
+    def add_qa_document(self, question: str, answer: str, doc_id: str = None,
+                       metadata: Dict = None):
         """添加QA类型文档"""
         if doc_id is None:
             doc_id = f"qa_{self.qa_collection.count() + 1}"
@@ -72,13 +145,15 @@ class VectorDB:
             metadatas={
                 "type": "qa",
                 "question": question,
-                "answer": answer
+                "answer": answer,
+                **self._clean_metadata(metadata)
             },
             ids=[doc_id]
         )
     
-    def add_doc_document(self, text: str, doc_id: str = None, source: str = None):
-        """添加Doc类型文档"""
+    def add_doc_document(self, text: str, doc_id: str = None, source: str = None,
+                        metadata: Dict = None) -> str:
+        """添加Doc类型文档，返回文档ID"""
         if doc_id is None:
             doc_id = f"doc_{self.doc_collection.count() + 1}"
         
@@ -87,58 +162,150 @@ class VectorDB:
         self.doc_collection.add(
             documents=[text],
             embeddings=[embedding.tolist()],
-            metadatas={"type": "docs", "source": source or "unknown"},
+            metadatas={
+                "type": "docs",
+                "source": source or "unknown",
+                **self._clean_metadata(metadata)
+            },
             ids=[doc_id]
         )
+        
+        return doc_id
     
     def search_query(self, query: str, top_k: int = 5, 
-                    threshold: float = 0.90) -> List[Dict]:
+                    threshold: float = 0.90,
+                    filters: Dict = None) -> List[Dict]:
         """查询Query库（高阈值）"""
         query_embedding = self.embedding_model.encode([query])[0]
         
         results = self.query_collection.query(
             query_embeddings=[query_embedding.tolist()],
-            n_results=top_k
+            n_results=top_k,
+            where=self._build_where(filters)
         )
         
         return self._parse_results(results, threshold)
     
     def search_qa(self, query: str, top_k: int = 5,
-                 threshold: float = 0.75) -> List[Dict]:
+                 threshold: float = 0.75,
+                 filters: Dict = None) -> List[Dict]:
         """查询QA库（中等阈值）"""
         query_embedding = self.embedding_model.encode([query])[0]
         
         results = self.qa_collection.query(
             query_embeddings=[query_embedding.tolist()],
-            n_results=top_k
+            n_results=top_k,
+            where=self._build_where(filters)
         )
         
         return self._parse_results(results, threshold)
     
     def search_docs(self, query: str, top_k: int = 5,
-                   threshold: float = 0.70) -> List[Dict]:
+                   threshold: float = 0.70,
+                   filters: Dict = None) -> List[Dict]:
         """查询Doc库（中等阈值）"""
         query_embedding = self.embedding_model.encode([query])[0]
         
         results = self.doc_collection.query(
             query_embeddings=[query_embedding.tolist()],
-            n_results=top_k
+            n_results=top_k,
+            where=self._build_where(filters)
         )
         
         return self._parse_results(results, threshold)
     
+    def search_query_batch(self, queries: List[str], top_k: int = 5,
+                          threshold: float = 0.90,
+                          query_embeddings: np.ndarray = None,
+                          filters: Dict = None) -> List[List[Dict]]:
+        """批量查询Query库"""
+        return self._search_batch(
+            self.query_collection, queries, top_k, threshold, query_embeddings, filters
+        )
+    
+    def search_qa_batch(self, queries: List[str], top_k: int = 5,
+                       threshold: float = 0.75,
+                       query_embeddings: np.ndarray = None,
+                       filters: Dict = None) -> List[List[Dict]]:
+        """批量查询QA库"""
+        return self._search_batch(
+            self.qa_collection, queries, top_k, threshold, query_embeddings, filters
+        )
+    
+    def search_docs_batch(self, queries: List[str], top_k: int = 5,
+                         threshold: float = 0.70,
+                         query_embeddings: np.ndarray = None,
+                         filters: Dict = None) -> List[List[Dict]]:
+        """批量查询Doc库"""
+        return self._search_batch(
+            self.doc_collection, queries, top_k, threshold, query_embeddings, filters
+        )
+    
+    def _search_batch(self, collection, queries: List[str], top_k: int,
+                     threshold: float,
+                     query_embeddings: np.ndarray = None,
+                     filters: Dict = None) -> List[List[Dict]]:
+        """一次多查询检索，可传入预先计算好的embedding"""
+        if not queries:
+            return []
+        
+        if query_embeddings is None:
+            query_embeddings = self.embedding_model.encode(queries)
+        
+        results = collection.query(
+            query_embeddings=[e.tolist() for e in query_embeddings],
+            n_results=top_k,
+            where=self._build_where(filters)
+        )
+        
+        return [
+            self._parse_results(results, threshold, i)
+            for i in range(len(queries))
+        ]
+    
+    @staticmethod
+    def _clean_metadata(metadata: Dict = None) -> Dict:
+        """只保留结构化元数据字段，并去掉空值"""
+        return {
+            k: v for k, v in (metadata or {}).items()
+            if v not in (None, '') and k in METADATA_FIELDS
+        }
+    
+    @staticmethod
+    def _build_where(filters: Dict = None):
+        """把过滤条件转换为Chroma where子句
+        
+        filters形如 {"product_line": "fund", "tenant": ["a", "b"]}，
+        列表取值表示任一匹配，多个字段之间为AND。
+        """
+        clauses = []
+        for field, value in (filters or {}).items():
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple, set)):
+                clauses.append({field: {"$in": list(value)}})
+            else:
+                clauses.append({field: value})
+        
+        if not clauses:
+            return None
+        if len(clauses) == 1:
+            return clauses[0]
+        return {"$and": clauses}
+    
     @staticmethod
-    def _parse_results(results: Dict, threshold: float) -> List[Dict]:
-        """解析查询结果"""
+    def _parse_results(results: Dict, threshold: float,
+                      index: int = 0) -> List[Dict]:
+        """解析查询结果（index为多查询结果中的第几条）"""
         output = []
         
-        if not results['documents'][0]:
+        if not results['documents'][index]:
             return output
         
         for doc, distance, metadata in zip(
-            results['documents'][0],
-            results['distances'][0],
-            results['metadatas'][0]
+            results['documents'][index],
+            results['distances'][index],
+            results['metadatas'][index]
         ):
             # 距离转相似度
             similarity = 1 - distance
@@ -0,0 +1,86 @@
+"""重排基准测试
+
+在同一份评测集上对比现有阈值判定与交叉编码器重排判定：
+检索延迟、各层命中分布、送入LLM的上下文条数、LLM调用率和上下文命中率。
+只做检索与层级判定，不调用LLM。
+
+评测集为JSON列表，expected为正确答案所在文本中应出现的关键片段:
+    [{"query": "基金赎回多久到账？", "expected": "T+1"}, ...]
+
+用法:
+    python scripts/benchmark_rerank.py --eval eval.json --top-k 5
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.retriever import get_retriever
+from modules.reranker import Reranker
+from modules.knowledge_builder import KnowledgeBuilder
+
+
+def context_texts(results):
+    """结果中可能包含答案的文本"""
+    texts = []
+    for r in results:
+        texts.append(r['text'])
+        texts.append((r.get('metadata') or {}).get('answer', ''))
+    return texts
+
+
+def run(name: str, retriever, eval_set, top_k: int):
+    latencies, n_contexts, hits = [], [], []
+    layers = Counter()
+
+    for item in eval_set:
+        start = time.perf_counter()
+        layer, results = retriever.select_layer(item['query'], top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        layers[layer] += 1
+        n_contexts.append(len(results))
+        hits.append(any(item['expected'] in t for t in context_texts(results)))
+
+    total = len(eval_set)
+    llm_calls = total - layers[1]
+    print(f"\n===== {name} =====")
+    print(f"平均延迟 {np.mean(latencies):.2f}ms  P95 {np.percentile(latencies, 95):.2f}ms")
+    print("层级分布 " + "  ".join(
+        f"L{layer}:{layers[layer] / total:.1%}" for layer in range(1, 6)
+    ))
+    print(f"平均上下文条数 {np.mean(n_contexts):.2f}  "
+          f"LLM调用率 {llm_calls / total:.1%}  "
+          f"上下文命中率 {np.mean(hits):.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='重排基准测试')
+    parser.add_argument('--eval', required=True, help='评测集JSON文件')
+    parser.add_argument('--top-k', type=int, default=5)
+    args = parser.parse_args()
+
+    with open(args.eval, 'r', encoding='utf-8') as f:
+        eval_set = json.load(f)
+
+    print(f"📊 评测集: {len(eval_set)}条")
+
+    retriever = get_retriever()
+    KnowledgeBuilder().rebuild_bm25()
+
+    retriever.reranker = None
+    run('当前阈值', retriever, eval_set, args.top_k)
+
+    retriever.reranker = Reranker()
+    run('交叉编码器重排（冷缓存）', retriever, eval_set, args.top_k)
+    run('交叉编码器重排（热缓存）', retriever, eval_set, args.top_k)
+
+
+if __name__ == '__main__':
+    main()
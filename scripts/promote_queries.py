@@ -0,0 +1,47 @@
+"""高频查询提升到Query库
+
+根据查询日志把高频问题按embedding聚类，列出可提升到Query库的簇，
+并估算提升后节省的延迟和LLM成本。加 --apply 时批量写入Query库。
+
+用法:
+    python scripts/promote_queries.py --top 20
+    python scripts/promote_queries.py --top 20 --apply
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.query_promoter import QueryPromoter
+
+
+def main():
+    parser = argparse.ArgumentParser(description='高频查询提升到Query库')
+    parser.add_argument('--top', type=int, default=20, help='最多提升的簇数')
+    parser.add_argument('--apply', action='store_true', help='写入Query库')
+    args = parser.parse_args()
+
+    promoter = QueryPromoter()
+    records = promoter.query_log.load()
+    candidates = promoter.candidates(args.top, promoter.cluster(records))
+    report = promoter.report(candidates, records)
+
+    print(f"📊 日志共{report['total_queries']}条，第1层平均延迟 {report['layer1_latency_ms']}ms")
+    print(f"{'次数':>6} {'问法':>4} {'层':>2} {'LLM调用':>8} {'平均延迟ms':>10} "
+          f"{'节省ms':>10} {'节省成本':>8}  代表问题")
+    for row in report['candidates']:
+        print(f"{row['count']:>6} {row['members']:>4} {row['layer']:>2} "
+              f"{row['slow_calls']:>8} {row['avg_latency_ms']:>10.1f} "
+              f"{row['saved_latency_ms']:>10.1f} {row['saved_cost']:>8.2f}  {row['query']}"
+              + (f"  {row['filters']}" if row['filters'] else ''))
+    print(f"\n覆盖 {report['covered_queries']}条 ({report['covered_ratio']:.1%})，"
+          f"预计节省 {report['saved_latency_ms'] / 1000:.1f}s 延迟、"
+          f"{report['saved_cost']:.2f} LLM成本（按日志覆盖的时间段计）")
+
+    if args.apply and candidates:
+        promoter.promote(candidates)
+
+
+if __name__ == '__main__':
+    main()
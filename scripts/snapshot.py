@@ -0,0 +1,60 @@
+"""知识库快照导出/导入
+
+用法:
+    python scripts/snapshot.py export kb.snap --dtype float16
+    python scripts/snapshot.py import kb.snap [--replace] [--force]
+    python scripts/snapshot.py verify kb.snap
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.snapshot import export_snapshot, load_snapshot, read_snapshot
+from modules.bm25_retriever import get_bm25_retriever
+from modules.knowledge_builder import KnowledgeBuilder
+from modules.vector_db import get_vector_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description='知识库快照导出/导入')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='导出快照')
+    export_parser.add_argument('path')
+    export_parser.add_argument('--dtype', choices=['float32', 'float16'],
+                               default='float32', help='embedding存储精度')
+
+    import_parser = subparsers.add_parser('import', help='校验并导入快照')
+    import_parser.add_argument('path')
+    import_parser.add_argument('--replace', action='store_true',
+                               help='清空现有集合后导入')
+    import_parser.add_argument('--force', action='store_true',
+                               help='embedding模型或维度与当前配置不一致时仍导入')
+
+    verify_parser = subparsers.add_parser('verify', help='只校验快照完整性')
+    verify_parser.add_argument('path')
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'export':
+            # BM25只在内存中，导出前从Doc库重建
+            if get_bm25_retriever().bm25 is None:
+                KnowledgeBuilder().rebuild_bm25()
+            export_snapshot(args.path, args.dtype)
+        elif args.command == 'import':
+            load_snapshot(args.path, replace=args.replace, force=args.force)
+            get_vector_db().persist()
+        else:
+            header, _ = read_snapshot(args.path)
+            counts = {name: c['count'] for name, c in header['collections'].items()}
+            print(f"✅ 快照校验通过: v{header['version']} {header['dtype']} {counts}")
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import threading
+
+import jieba
+import numpy as np
+import pytest
+
+from modules.bm25_retriever import BM25Retriever
+
+DOCS = [
+    "基金赎回一般T+1到账",
+    "货币基金赎回当日到账",
+    "信用卡年费首年免收",
+    "信用卡逾期会产生罚息",
+    "股票基金申购费率1.5%",
+    "基金赎回一般T+1到账",
+    "理财产品到期自动赎回",
+    "开户需要身份证和银行卡",
+]
+METADATAS = [
+    {"product_line": "fund", "tenant": "a"},
+    {"product_line": "fund", "tenant": "b"},
+    {"product_line": "card", "tenant": "a"},
+    {"product_line": "card", "tenant": "b"},
+    {"product_line": "fund", "tenant": "a"},
+    {"product_line": "fund", "tenant": "b"},
+    {"product_line": "wealth", "tenant": "a"},
+    {},
+]
+QUERIES = ["基金赎回多久到账", "信用卡年费", "赎回", "身份证开户", "完全无关的问题"]
+
+
+@pytest.fixture
+def retriever():
+    r = BM25Retriever()
+    r.add_documents(DOCS, [f"doc_{i}" for i in range(len(DOCS))], METADATAS)
+    return r
+
+
+def assert_same(batch, single):
+    assert [r['doc_id'] for r in batch] == [r['doc_id'] for r in single]
+    assert np.allclose([r['score'] for r in batch], [r['score'] for r in single])
+
+
+@pytest.mark.parametrize("filters", [
+    None,
+    {"product_line": "fund"},
+    {"product_line": ["card", "wealth"]},
+    {"product_line": "fund", "tenant": "b"},
+    {"product_line": "missing"},
+])
+def test_search_batch_matches_search(retriever, filters):
+    batch = retriever.search_batch(QUERIES, 3, filters)
+    assert len(batch) == len(QUERIES)
+    for query, results in zip(QUERIES, batch):
+        assert_same(results, retriever.search(query, 3, filters))
+
+
+def test_search_batch_scores_match_bm25okapi(retriever):
+    index = retriever._index
+    for query, results in zip(QUERIES, retriever.search_batch(QUERIES, len(DOCS))):
+        scores = index.bm25.get_scores(list(jieba.cut(query)))
+        for r in results:
+            assert r['score'] == pytest.approx(scores[index.doc_ids.index(r['doc_id'])])
+        assert len(results) == int((scores > 0).sum())
+
+
+def test_search_batch_chunking(retriever):
+    retriever.batch_chunk_size = 2
+    batch = retriever.search_batch(QUERIES, 3)
+    for query, results in zip(QUERIES, batch):
+        assert_same(results, retriever.search(query, 3))
+
+
+def test_ties_keep_document_order(retriever):
+    results = retriever.search_batch(["基金赎回一般T+1到账"], 2)[0]
+    assert [r['doc_id'] for r in results] == ["doc_0", "doc_5"]
+    assert results[0]['score'] == results[1]['score']
+
+
+def test_empty_index():
+    r = BM25Retriever()
+    assert r.search("基金", 3) == []
+    assert r.search_batch(["基金", "赎回"], 3) == [[], []]
+
+
+def test_append_matches_full_rebuild(retriever):
+    new_docs = ["基金定投可随时赎回", "信用卡分期手续费"]
+    new_ids = ["doc_new_0", "doc_new_1"]
+    new_metadatas = [{"product_line": "fund"}, {"product_line": "card"}]
+    retriever.append_documents(new_docs, new_ids, new_metadatas)
+    # 已索引的doc_id被跳过
+    retriever.append_documents(["重复"], ["doc_0"])
+
+    full = BM25Retriever()
+    full.add_documents(
+        DOCS + new_docs,
+        [f"doc_{i}" for i in range(len(DOCS))] + new_ids,
+        METADATAS + new_metadatas
+    )
+
+    assert retriever.doc_ids == full.doc_ids
+    for filters in (None, {"product_line": "card"}):
+        for a, b in zip(retriever.search_batch(QUERIES, 5, filters),
+                        full.search_batch(QUERIES, 5, filters)):
+            assert_same(a, b)
+
+
+def test_search_during_concurrent_appends(retriever):
+    errors, stop = [], threading.Event()
+
+    def read():
+        while not stop.is_set():
+            try:
+                retriever.search_batch(QUERIES, 3)
+                retriever.search(QUERIES[0], 3, {"product_line": "fund"})
+            except Exception as e:
+                errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(3)]
+    for t in readers:
+        t.start()
+
+    def append(k):
+        retriever.append_documents(
+            [f"新增文档{k}号 基金{i} 赎回{k}" for i in range(50)],
+            [f"append_{k}_{i}" for i in range(50)],
+            [{"product_line": "fund"}] * 50
+        )
+
+    writers = [threading.Thread(target=append, args=(k,)) for k in range(4)]
+    for t in writers:
+        t.start()
+    for t in writers:
+        t.join()
+    stop.set()
+    for t in readers:
+        t.join()
+
+    assert errors == []
+    assert len(retriever.doc_ids) == len(DOCS) + 200
@@ -0,0 +1,213 @@
+import struct
+import sys
+import types
+
+import numpy as np
+import pytest
+
+pytest.importorskip("chromadb")
+# 快照读写不需要embedding模型，避免测试时加载SentenceTransformer
+sys.modules.setdefault(
+    "modules.embedding_model", types.SimpleNamespace(get_embedding_model=lambda: None)
+)
+
+from modules import snapshot  # noqa: E402
+from modules.bm25_retriever import BM25Retriever  # noqa: E402
+
+DIM = 8
+
+
+class FakeCollection:
+    def __init__(self):
+        self.ids, self.documents, self.metadatas, self.embeddings = [], [], [], []
+
+    def add(self, ids, documents, metadatas, embeddings):
+        self.ids += ids
+        self.documents += documents
+        self.metadatas += metadatas
+        self.embeddings += [list(e) for e in embeddings]
+
+    def get(self, include=None):
+        return {
+            "ids": list(self.ids),
+            "documents": list(self.documents),
+            "metadatas": list(self.metadatas),
+            "embeddings": [list(e) for e in self.embeddings] or None,
+        }
+
+    def count(self):
+        return len(self.ids)
+
+
+class FakeVectorDB:
+    def __init__(self, dim=DIM):
+        self.embedding_model = types.SimpleNamespace(embedding_dim=dim)
+        self.client = types.SimpleNamespace(delete_collection=lambda name: None)
+        self.kb_version = 0
+        self._init_collections()
+
+    def _init_collections(self):
+        self.query_collection = FakeCollection()
+        self.qa_collection = FakeCollection()
+        self.doc_collection = FakeCollection()
+
+    def bump_kb_version(self):
+        self.kb_version += 1
+        return self.kb_version
+
+
+DOCS = ["基金赎回一般T+1到账", "信用卡年费首年免收", "开户需要身份证和银行卡"]
+DOC_METADATAS = [
+    {"source": "a.pdf", "product_line": "fund", "tenant": "a"},
+    {"source": "b.pdf", "product_line": "card"},
+    {"source": "c.txt"},
+]
+
+
+@pytest.fixture
+def source(monkeypatch):
+    monkeypatch.setenv("EMBEDDING_MODEL", "test-model")
+    rng = np.random.default_rng(0)
+    db = FakeVectorDB()
+    db.query_collection.add(
+        ["query_1"], ["你好"], [{"type": "query", "answer": "您好"}],
+        rng.standard_normal((1, DIM)).tolist()
+    )
+    db.doc_collection.add(
+        [f"doc_{i}" for i in range(len(DOCS))], DOCS, DOC_METADATAS,
+        rng.standard_normal((len(DOCS), DIM)).tolist()
+    )
+    bm25 = BM25Retriever()
+    # 只有部分文档已在BM25中，其余在导出时分词
+    bm25.add_documents(DOCS[:2], ["doc_0", "doc_1"])
+    return db, bm25
+
+
+@pytest.fixture
+def snap_path(source, tmp_path):
+    db, bm25 = source
+    path = str(tmp_path / "kb.snap")
+    snapshot.export_snapshot(path, vector_db=db, bm25=bm25)
+    return path
+
+
+def test_round_trip(source, snap_path):
+    db, _ = source
+    target, bm25 = FakeVectorDB(), BM25Retriever()
+    counts = snapshot.load_snapshot(snap_path, vector_db=target, bm25=bm25)
+
+    assert counts == {"query_kb": 1, "qa_kb": 0, "doc_kb": 3, "bm25": 3}
+    for attr in snapshot.COLLECTIONS.values():
+        original, restored = getattr(db, attr), getattr(target, attr)
+        assert restored.ids == original.ids
+        assert restored.documents == original.documents
+        assert restored.metadatas == original.metadatas
+        assert np.array_equal(
+            np.asarray(restored.embeddings, dtype=np.float32).reshape(-1, DIM),
+            np.asarray(original.embeddings, dtype=np.float32).reshape(-1, DIM)
+        )
+    assert target.kb_version == 1
+
+    expected = BM25Retriever()
+    expected.add_documents(
+        DOCS, [f"doc_{i}" for i in range(len(DOCS))],
+        [{k: m[k] for k in ("product_line", "tenant") if k in m} for m in DOC_METADATAS]
+    )
+    assert bm25.tokenized_docs == expected.tokenized_docs
+    assert bm25.metadatas == expected.metadatas
+    assert bm25.search("基金赎回", 3) == expected.search("基金赎回", 3)
+
+
+def test_header(snap_path):
+    header, blocks = snapshot.read_snapshot(snap_path)
+    assert header["version"] == snapshot.SNAPSHOT_VERSION
+    assert header["embedding_dim"] == DIM
+    assert header["embedding_model"] == "test-model"
+    assert {name: c["count"] for name, c in header["collections"].items()} == {
+        "query_kb": 1, "qa_kb": 0, "doc_kb": 3
+    }
+    assert isinstance(blocks["doc_kb.embeddings"], np.memmap)
+    # 文本只保存在doc_kb中，BM25部分只有词表和词ID
+    assert not any(name.startswith("bm25.documents") for name in blocks)
+
+
+def test_float16_round_trip(source, tmp_path):
+    db, bm25 = source
+    path = str(tmp_path / "kb16.snap")
+    snapshot.export_snapshot(path, dtype="float16", vector_db=db, bm25=bm25)
+    target = FakeVectorDB()
+    snapshot.load_snapshot(path, vector_db=target, bm25=BM25Retriever())
+    assert np.allclose(target.doc_collection.embeddings, db.doc_collection.embeddings, atol=1e-2)
+
+
+@pytest.mark.parametrize("data", [b"", b"FRAG", b"x" * snapshot.PREAMBLE.size])
+def test_rejects_short_or_foreign_files(tmp_path, data):
+    path = tmp_path / "bad.snap"
+    path.write_bytes(data)
+    with pytest.raises(ValueError):
+        snapshot.read_snapshot(str(path))
+
+
+def test_rejects_truncated_file(snap_path, tmp_path):
+    data = open(snap_path, "rb").read()
+    for size in (snapshot.PREAMBLE.size + 10, len(data) - 1):
+        path = tmp_path / "truncated.snap"
+        path.write_bytes(data[:size])
+        with pytest.raises(ValueError):
+            snapshot.read_snapshot(str(path))
+
+
+def test_rejects_corrupted_block(snap_path):
+    header, _ = snapshot.read_snapshot(snap_path)
+    header_len = struct.unpack_from("<Q", open(snap_path, "rb").read(), 12)[0]
+    data_start = snapshot._align(snapshot.PREAMBLE.size + header_len)
+    offset = data_start + header["blocks"]["doc_kb.documents.data"]["offset"]
+
+    with open(snap_path, "r+b") as f:
+        f.seek(offset)
+        byte = f.read(1)
+        f.seek(offset)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+    with pytest.raises(ValueError, match="doc_kb.documents.data"):
+        snapshot.read_snapshot(snap_path)
+    snapshot.read_snapshot(snap_path, verify=False)
+
+
+def test_rejects_other_version(snap_path):
+    with open(snap_path, "r+b") as f:
+        f.seek(8)
+        f.write(struct.pack("<I", snapshot.SNAPSHOT_VERSION + 1))
+    with pytest.raises(ValueError):
+        snapshot.read_snapshot(snap_path)
+
+
+def test_dim_mismatch_keeps_existing_kb(snap_path):
+    target = FakeVectorDB(dim=DIM * 2)
+    target.doc_collection.add(["keep"], ["保留"], [{}], [[0.0] * DIM * 2])
+    deleted = []
+    target.client.delete_collection = deleted.append
+
+    with pytest.raises(ValueError):
+        snapshot.load_snapshot(snap_path, replace=True, vector_db=target, bm25=BM25Retriever())
+    assert deleted == []
+    assert target.doc_collection.ids == ["keep"]
+    assert target.kb_version == 0
+
+
+def test_model_mismatch_requires_force(snap_path, monkeypatch):
+    monkeypatch.setenv("EMBEDDING_MODEL", "other-model")
+    with pytest.raises(ValueError):
+        snapshot.load_snapshot(snap_path, vector_db=FakeVectorDB(), bm25=BM25Retriever())
+
+    counts = snapshot.load_snapshot(
+        snap_path, force=True, vector_db=FakeVectorDB(), bm25=BM25Retriever()
+    )
+    assert counts["doc_kb"] == 3
+
+
+def test_requires_empty_target_without_replace(snap_path):
+    target = FakeVectorDB()
+    target.qa_collection.add(["qa_1"], ["问 AND 答"], [{}], [[0.0] * DIM])
+    with pytest.raises(ValueError):
+        snapshot.load_snapshot(snap_path, vector_db=target, bm25=BM25Retriever())